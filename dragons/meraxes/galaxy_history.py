@@ -4,12 +4,22 @@
 """Generate the full (first progenitor line) history of a galaxy."""
 
 from ..munge import ndarray_to_dataframe
-from .io import read_gals, read_firstprogenitor_indices, read_descendant_indices
+from .io import (
+    read_gals_soa,
+    read_units,
+    _gal_dtype,
+    _read_one_gal,
+    _read_one_fp_index,
+    _read_one_desc_index,
+    _to_native,
+    _little_h,
+)
 from tqdm import tqdm
 
 import numpy as np
+import h5py as h5
 
-def galaxy_history(fname, gal_id, snapshot, future_snapshot=-1, pandas=False, props=None):
+def galaxy_history(fname, gal_id, snapshot, future_snapshot=-1, pandas=False, props=None, progress=None):
 
     """ Read in the full first progenitor history of a galaxy at a given final
     snapshot.
@@ -35,6 +45,10 @@ def galaxy_history(fname, gal_id, snapshot, future_snapshot=-1, pandas=False, pr
     pandas : bool
         Return panads dataframe.  (default = False)
 
+    progress : bool
+        Show a progress bar while walking the trees.  If None, it is only
+        shown when stderr is a terminal.  (default = None)
+
     Returns
     -------
     history : ndarray or DataFrame
@@ -47,41 +61,68 @@ def galaxy_history(fname, gal_id, snapshot, future_snapshot=-1, pandas=False, pr
         then the galaxy remains until `future_snapshot.`
     """
 
-    gals = read_gals(fname, snapshot=snapshot, props=props, pandas=False)
-
-    start_ind = np.where(gals["ID"] == gal_id)[0][0]
+    # Only the IDs are needed to find the target galaxy
+    start_ind = np.where(read_gals_soa(fname, snapshot=snapshot, props=["ID"])["ID"] == gal_id)[0][0]
     merged_snapshot = -1
 
     if future_snapshot == -1:
         future_snapshot = snapshot
-    history = np.zeros(future_snapshot + 1, dtype=gals.dtype)
 
-    history[snapshot] = gals[start_ind]
-    ind = read_firstprogenitor_indices(fname, snapshot)[start_ind]
+    # Only scale the galaxies with h if `set_little_h` has been called
+    h = _little_h()
+
+    # Galaxies are collected per snapshot and only packed into the output
+    # array once the walk is over.
+    snaps = []
+    rows = []
+
+    # Only redraw the progress bar every few percent of the walk
+    tqdm_kw = dict(
+        mininterval=0.5, miniters=max(1, snapshot // 100), disable=None if progress is None else not progress
+    )
 
-    if ind == -1:
-        raise Warning("This galaxy has no progenitors!")
+    # Walk the trees through a single open file handle, reading only the one
+    # galaxy and progenitor/descendant index needed at each snapshot.
+    with h5.File(fname, "r") as fin:
+        h_conv = read_units(fin)["HubbleConversions"] if h is not None else None
+        gal_dtype = _gal_dtype(fin["Snap{:03d}".format(snapshot)], props)
+
+        snaps.append(snapshot)
+        rows.append(_read_one_gal(fin, snapshot, start_ind, gal_dtype, h_conv, h))
+        ind = _read_one_fp_index(fin, snapshot, start_ind)
 
-    for snap in tqdm(list(range(snapshot - 1, 0, -1))):
-        history[snap] = read_gals(fname, snapshot=snap, pandas=False, props=props, indices=[ind])
-        ind = read_firstprogenitor_indices(fname, snap)[ind]
         if ind == -1:
-            break
+            raise Warning("This galaxy has no progenitors!")
 
-    if future_snapshot != snapshot:
-        ind = start_ind
-        for snap in tqdm(list(range(snapshot + 1, future_snapshot + 1))):
-            last_ind = ind
-            ind = read_descendant_indices(fname, snap - 1)[ind]
+        for snap in tqdm(range(snapshot - 1, 0, -1), **tqdm_kw):
+            snaps.append(snap)
+            rows.append(_read_one_gal(fin, snap, ind, gal_dtype, h_conv, h))
+            ind = _read_one_fp_index(fin, snap, ind)
             if ind == -1:
                 break
 
-            if snap < future_snapshot:
-                fp = read_firstprogenitor_indices(fname, snap)[ind]
-                if fp != last_ind and merged_snapshot == -1:
-                    merged_snapshot = snap
+        if future_snapshot != snapshot:
+            ind = start_ind
+            for snap in tqdm(range(snapshot + 1, future_snapshot + 1), **tqdm_kw):
+                last_ind = ind
+                ind = _read_one_desc_index(fin, snap - 1, ind)
+                if ind == -1:
+                    break
+
+                if snap < future_snapshot:
+                    fp = _read_one_fp_index(fin, snap, ind)
+                    if fp != last_ind and merged_snapshot == -1:
+                        merged_snapshot = snap
+
+                snaps.append(snap)
+                rows.append(_read_one_gal(fin, snap, ind, gal_dtype, h_conv, h))
+
+    # Snapshots the galaxy does not exist at are left zeroed
+    history = np.zeros(future_snapshot + 1, dtype=gal_dtype)
+    history[snaps] = rows
 
-            history[snap] = read_gals(fname, snapshot=snap, pandas=False, props=props, indices=[ind])
+    # Match read_gals in returning native byte order galaxies
+    history = _to_native(history)
 
     if pandas:
         history = ndarray_to_dataframe(history)
@@ -5,19 +5,53 @@
 
 from ..munge import ndarray_to_dataframe
 
+import os
 import re
+from contextlib import contextmanager
+from functools import lru_cache
 import numpy as np
 import h5py as h5
+from h5py import h5d, h5p, h5s
 from astropy.table import Table
 import pandas as pd
 import logging
 from pathlib import PurePath
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 __meraxes_h = None
 logger = logging.getLogger(__name__)
 logger.setLevel("WARNING")
 
+# Match the name of a snapshot group, capturing the snapshot number
+_match_snap = re.compile(r"Snap(\d{3,})$").match
+
+# Match the Hubble conversion strings which just scale v by a power of h
+# (e.g. `v/h`, `v*h**2`) or shift it by a multiple of log10(h) (e.g.
+# `v+5.0*log10(h)`), capturing the operator and power/coefficient
+_match_h_power = re.compile(r"v\s*([*/])\s*h(?:\s*\*\*\s*(\d+(?:\.\d*)?))?").fullmatch
+_match_h_log = re.compile(r"v\s*([+-])\s*(\d+(?:\.\d*)?)\s*\*\s*log10\(\s*h\s*\)").fullmatch
+
+# Number of full snapshot index arrays (of each of the first progenitor, next
+# progenitor and descendant types) kept in memory.  These can be many GB each
+# for large runs, so only enough for walking between neighbouring snapshots
+# are kept.
+_INDEX_CACHE_SIZE = 2
+
+# Per file version caches of the snapshot groups present in each file, and
+# the core offsets table of each snapshot
+_SNAP_NAMES_CACHE = {}
+_SNAP_NAMES_CACHE_SIZE = 32
+_CORE_OFFSETS_CACHE = {}
+_CORE_OFFSETS_CACHE_SIZE = 256
+
+# Default size of the chunk cache used when reading each galaxy dataset
+_GALS_RDCC_NBYTES = 256 * 1024 ** 2
+
 
 def _check_pandas():
     try:
@@ -26,6 +60,30 @@ def _check_pandas():
         raise ImportError("The pandas package must be available if" " pandas=True.")
 
 
+def _apply_offset(ind, offset):
+    # Add `offset` to every index that is not -1 (in place).
+    np.add(ind, offset, out=ind, where=ind > -1)
+
+
+def _apply_core_offsets_numpy(ind, core_id, core_counter):
+    # Add the offset of the source core to every index that is not -1 (in
+    # place).
+    np.add(ind, core_counter[core_id], out=ind, where=ind > -1)
+
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _apply_core_offsets(ind, core_id, core_counter):
+        for ii in prange(ind.size):
+            if ind[ii] > -1:
+                ind[ii] += core_counter[core_id[ii]]
+
+
+else:
+    _apply_core_offsets = _apply_core_offsets_numpy
+
+
 def set_little_h(h=None):
 
     """ Set the value of little h to be used by all future meraxes.io calls
@@ -59,8 +117,265 @@ def set_little_h(h=None):
     return h
 
 
+def _little_h(h=None):
+    # Return `h`, falling back to the value set with `set_little_h` if it is
+    # None.  A return value of None means no Hubble scaling is to be done.
+    if (h is None) and (__meraxes_h is not None):
+        h = __meraxes_h
+    return h
+
+
+@contextmanager
+def _open(fname):
+    # Yield the open Meraxes file `fname`.  If `fname` is a path then the file
+    # is opened (and closed again afterwards), but an already open h5py File
+    # is passed straight through and left open.
+    if isinstance(fname, h5.File):
+        yield fname
+    else:
+        with h5.File(fname, "r") as fin:
+            yield fin
+
+
+def _to_native(arr):
+    # Return `arr` in native byte order, only making a (byte swapped) copy if
+    # it isn't already.  Note that dtype.isnative can't be trusted here as it
+    # ignores the byte order of sub-array fields.
+    native = arr.dtype.newbyteorder("=")
+    return arr if arr.dtype == native else arr.astype(native)
+
+
+def _file_key(fin):
+    # Return a (path, mtime) key identifying the version of an open file on
+    # disk, so that rewritten files aren't served stale cached values.  Files
+    # which aren't plain files on disk (opened from file-like objects, or
+    # with the core, family, split, ... drivers) have no such key, and None
+    # is returned.
+    if fin.driver != "sec2" or not os.path.isfile(fin.filename):
+        return None
+    return fin.filename, os.path.getmtime(fin.filename)
+
+
+def _cache_lookup(cache, max_size, key, compute):
+    # Return `cache[key]`, filling it with `compute()` on a miss and evicting
+    # the oldest entry if the cache is full.  A key of None bypasses the
+    # cache altogether.
+    if key is None:
+        return compute()
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    value = compute()
+    if len(cache) >= max_size:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+    return value
+
+
+def _next_prime(n):
+    # Return the smallest prime >= n.
+    n = max(n, 2)
+    while any(n % d == 0 for d in range(2, int(n ** 0.5) + 1)):
+        n += 1
+    return n
+
+
+def _open_galaxies(snap_group, i_core, rdcc_nbytes=None):
+    # Open the Galaxies dataset of a core.  Chunked datasets get a chunk cache
+    # of `rdcc_nbytes` (large enough that chunks aren't repeatedly
+    # decompressed), with a prime number of hash slots ~100 times the number
+    # of chunks that fit in it, as recommended by HDF5.  There's no point in
+    # more slots than the dataset has chunks though.
+    name = f"Core{i_core}/Galaxies".encode()
+    dsid = h5d.open(snap_group.id, name)
+    dcpl = dsid.get_create_plist()
+    if dcpl.get_layout() == h5d.CHUNKED:
+        if rdcc_nbytes is None:
+            rdcc_nbytes = _GALS_RDCC_NBYTES
+        chunks = dcpl.get_chunk()
+        chunk_nbytes = int(np.prod(chunks)) * dsid.get_type().get_size()
+        n_chunks = int(np.prod(-(-np.asarray(dsid.shape) // chunks)))
+        n_slots = _next_prime(max(1, min(100 * (rdcc_nbytes // chunk_nbytes), n_chunks)))
+        # the dataset must be closed before reopening, otherwise HDF5 keeps
+        # the chunk cache it was first opened with
+        dsid.close()
+        dapl = h5p.create(h5p.DATASET_ACCESS)
+        dapl.set_chunk_cache(n_slots, rdcc_nbytes, 0.75)
+        dsid = h5d.open(snap_group.id, name, dapl=dapl)
+    return h5.Dataset(dsid)
+
+
+def _snap_names(fin):
+    # Return a tuple of (snapshot, group name) pairs for the snapshot groups
+    # present in an open Meraxes file, sorted by snapshot.  The result is
+    # cached per version of the file (see `_file_key`).
+    def scan():
+        return tuple(sorted((int(m.group(1)), m.group(0)) for m in map(_match_snap, fin) if m))
+
+    return _cache_lookup(_SNAP_NAMES_CACHE, _SNAP_NAMES_CACHE_SIZE, _file_key(fin), scan)
+
+
+def _list_snaps(fin):
+    # Return a sorted array of the snapshots present in an open Meraxes file.
+    names = _snap_names(fin)
+    return np.fromiter((snap for snap, _ in names), dtype=np.int32, count=len(names))
+
+
+def _gal_dtype(snap_group, props=None):
+    # Construct the galaxy dtype for the requested properties from the
+    # dataset metadata alone (i.e. without reading any galaxies).  Reading
+    # into an array of this dtype lets HDF5 convert the compound type on the
+    # fly, so only the requested fields are ever copied out of the file.
+    full_dtype = snap_group["Core0/Galaxies"].dtype
+    if props is None:
+        return full_dtype
+    return np.dtype([(p, full_dtype.fields[p][0]) for p in props])
+
+
+def _core_offsets(fin, snapshot):
+    # Return the global index of the first galaxy on each core of a snapshot
+    # of an open Meraxes file, with the total number of galaxies as the final
+    # entry.  The table is cached per version of the file (see `_file_key`).
+    def compute():
+        n_cores = fin.attrs["NCores"][0]
+        snap_group = fin["Snap{:03d}".format(snapshot)]
+
+        # Use the per-core galaxy counts if the snapshot has them, otherwise
+        # query each core's dataset (through the low-level API, as the
+        # high-level Dataset wrapper is most of the cost of the lookup)
+        sizes = snap_group.attrs.get("NGalaxiesPerCore")
+        if sizes is None or np.size(sizes) != n_cores:
+            group_id = snap_group.id
+            sizes = np.fromiter(
+                (h5d.open(group_id, f"Core{i_core}/Galaxies".encode()).shape[0] for i_core in range(n_cores)),
+                "i8",
+                count=n_cores,
+            )
+
+        offsets = np.zeros(n_cores + 1, "i8")
+        np.cumsum(np.ravel(sizes), out=offsets[1:])
+        offsets.setflags(write=False)
+        return offsets
+
+    key = _file_key(fin)
+    if key is not None:
+        key += (snapshot,)
+    return _cache_lookup(_CORE_OFFSETS_CACHE, _CORE_OFFSETS_CACHE_SIZE, key, compute)
+
+
+def _sorted_indices(indices):
+    # Return the requested galaxy indices as a sorted int array.  The indices
+    # are only copied if they aren't already a contiguous int array, and only
+    # sorted if they aren't already in order.
+    indices = np.ascontiguousarray(indices, "i")
+    if np.any(indices[1:] < indices[:-1]):
+        indices = np.sort(indices)
+    return indices
+
+
+def _gal_read_plan(snap_group, offsets, ngals, indices=None, rdcc_nbytes=None):
+    # Generate (dataset, source selection, destination selection, offset)
+    # tuples describing every contiguous read needed to fill an array of
+    # `ngals` requested galaxies from a snapshot group.  `offsets` is the core
+    # offsets table from `_core_offsets` and the yielded offset is the
+    # global index of the first galaxy on the source core.  If given,
+    # `indices` must be sorted.  See `_read_sel` for the possible source
+    # selections.  `rdcc_nbytes` is passed on to `_open_galaxies`.
+    if indices is not None:
+        # where the requested indices of each core start and end
+        bounds = np.searchsorted(indices, offsets)
+
+    counter = 0
+    for i_core in range(offsets.size - 1):
+        if counter >= ngals:
+            break
+
+        total_read = offsets[i_core]
+        core_ngals = offsets[i_core + 1] - total_read
+
+        if core_ngals == 0:
+            continue
+
+        galaxies = _open_galaxies(snap_group, i_core, rdcc_nbytes)
+
+        if indices is None:
+            yield galaxies, None, np.s_[counter : core_ngals + counter], counter
+            counter += core_ngals
+
+        else:
+            read_ind = indices[bounds[i_core] : bounds[i_core + 1]] - total_read
+
+            if read_ind.shape[0] == 0:
+                continue
+
+            # find each run of consecutive indices
+            steps = np.diff(read_ind)
+            breaks = np.flatnonzero(steps != 1) + 1
+            starts = read_ind[np.r_[0, breaks]]
+            stops = read_ind[np.r_[breaks - 1, read_ind.size - 1]] + 1
+
+            if starts.size == 1:
+                yield galaxies, np.s_[starts[0] : stops[0]], np.s_[counter : read_ind.size + counter], total_read
+
+            elif not np.any(steps == 0):
+                # all of the runs can be read in one go
+                yield galaxies, (starts, stops - starts), np.s_[counter : read_ind.size + counter], total_read
+
+            else:
+                # repeated indices can't be expressed as a single selection,
+                # so read each requested galaxy once and then copy them out
+                # to the repeated positions
+                unique, inverse = np.unique(read_ind, return_inverse=True)
+                breaks = np.flatnonzero(np.diff(unique) != 1) + 1
+                starts = unique[np.r_[0, breaks]]
+                stops = unique[np.r_[breaks - 1, unique.size - 1]] + 1
+                yield galaxies, (starts, stops - starts, inverse), np.s_[counter : read_ind.size + counter], total_read
+
+            counter += read_ind.size
+
+
+def _read_sel(dataset, dest, source_sel, dest_sel):
+    # Read `source_sel` of `dataset` into `dest[dest_sel]`.  The source
+    # selection is either None (everything), a slice, or a (starts, counts)
+    # pair of arrays describing several runs of rows.  The runs are combined
+    # into a single hyperslab selection so that they are read with a single
+    # call into HDF5.  If no two indices are adjacent then there is nothing
+    # to coalesce and a point selection is cheaper to build.  A third
+    # `inverse` array means that the runs are of distinct rows, which are
+    # gathered into `dest[dest_sel]` as `rows[inverse]` after the read.
+    if source_sel is None or isinstance(source_sel, slice):
+        dataset.read_direct(dest, source_sel=source_sel, dest_sel=dest_sel)
+        return
+
+    starts, counts = source_sel[:2]
+    file_space = dataset.id.get_space()
+    if np.all(counts == 1):
+        file_space.select_elements(starts.reshape(-1, 1))
+    else:
+        file_space.select_none()
+        for start, count in zip(starts, counts):
+            file_space.select_hyperslab((int(start),), (int(count),), op=h5s.SELECT_OR)
+
+    dest = dest[dest_sel]
+    if len(source_sel) == 3:
+        rows = np.empty(counts.sum(), dtype=dest.dtype)
+        dataset.id.read(h5s.create_simple(rows.shape), file_space, rows)
+        np.take(rows, source_sel[2], out=dest)
+    else:
+        dataset.id.read(h5s.create_simple(dest.shape), file_space, dest)
+
+
 def read_gals(
-    fname, snapshot=None, props=None, sim_props=False, pandas=False, table=False, h=None, indices=None,
+    fname,
+    snapshot=None,
+    props=None,
+    sim_props=False,
+    pandas=False,
+    table=False,
+    h=None,
+    indices=None,
+    rdcc_nbytes=None,
 ):
 
     """Read in a Meraxes hdf5 output file.
@@ -99,51 +414,58 @@ def read_gals(
         Indices of galaxies to be read.  If `None` then read all galaxies.
         (default = None)
 
+    rdcc_nbytes : int
+        Size in bytes of the HDF5 chunk cache used for each galaxy dataset.
+        This only matters for chunked (e.g. compressed) output files, where
+        a cache too small to hold a core's galaxies means chunks are read
+        and decompressed again on every pass over them.  (default = 256 MB)
+
     Returns
     -------
         An ndarray with the requested galaxies and properties.
 
         If sim_props==True then output is a tuple of form (galaxies, sim_props)
+
+    Notes
+    -----
+    The galaxies of each core are read with a single HDF5 read per core.
+    When `indices` are given, all of the requested runs of consecutive
+    galaxies on a core are combined into one hyperslab (or point) selection
+    for that read.  Reading the cores from multiple threads gives no speed
+    up as h5py serialises all calls into the HDF5 library.  If many
+    snapshots are needed, read them from separate processes instead.
     """
 
     if (h is None) and (__meraxes_h is not None):
         h = __meraxes_h
 
-    def __apply_offsets(G, dest_sel, counter):
-        # Deal with any indices that need offsets applied
-        try:
-            G[dest_sel]["CentralGal"] += counter
-        except ValueError:
-            pass
-
     if pandas:
         _check_pandas()
 
     if pandas and table:
         logger.error("Both `pandas` and `table` specified.  Please choose one" " or the other.")
 
-    # Grab the units and hubble conversions information
-    units = read_units(fname)
-
     # Open the file for reading
     fin = h5.File(fname, "r")
 
+    # Grab the units and hubble conversions information (only needed for
+    # scaling or attaching units to the output)
+    if (h is not None) or pandas or table:
+        units = read_units(fin)
+
     # Set the snapshot correctly
     if snapshot is None:
         snapshot = -1
     if snapshot < 0:
-        present_snaps = np.asarray(list(fin.keys()))
-        selection = np.array([(p.find("Snap") == 0) for p in present_snaps])
-        present_snaps = [int(p[4:]) for p in present_snaps[selection]]
-        snapshot = sorted(present_snaps)[snapshot]
+        snapshot = _list_snaps(fin)[snapshot]
 
     logger.info("Reading snapshot %d" % snapshot)
 
     # Select the group for the requested snapshot.
     snap_group = fin["Snap%03d" % (snapshot)]
 
-    # How many cores have been used for this run?
-    n_cores = fin.attrs["NCores"][0]
+    # Where does the output of each core start?
+    offsets = _core_offsets(fin, snapshot)
 
     # Grab the total number of galaxies in this snapshot
     ngals = snap_group.attrs["NGalaxies"][0]
@@ -153,29 +475,11 @@ def read_gals(
 
     # Reset ngals to be the number of requested galaxies if appropriate
     if indices is not None:
-        indices = np.array(indices, "i")
-        indices.sort()
+        indices = _sorted_indices(indices)
         ngals = indices.shape[0]
 
     # Set the galaxy data type
-    gal_dtype = None
-    for i_core in range(n_cores):
-        try:
-            if props is not None:
-                gal_dtype = snap_group["Core%d/Galaxies" % i_core][tuple(props)][0].dtype
-            else:
-                gal_dtype = snap_group["Core%d/Galaxies" % i_core].dtype
-        except IndexError:
-            pass
-        if gal_dtype is not None:
-            break
-
-    # Newer versions of numpy will return a dtype with no fields if we have
-    # only requested one property.  We need to reconstruct a named dtype for
-    # the direct read below.
-    if gal_dtype.names is None:
-        assert len(props) == 1
-        gal_dtype = snap_group["Core%d/Galaxies" % i_core].dtype[props]
+    gal_dtype = _gal_dtype(snap_group, props)
 
     # Create a dataset large enough to hold all of the requested galaxies
     G = np.empty(ngals, dtype=gal_dtype)
@@ -183,39 +487,15 @@ def read_gals(
 
     # Loop through each of the requested groups and read in the galaxies
     if ngals > 0:
-        counter = 0
-        total_read = 0
-        for i_core in range(n_cores):
-            galaxies = snap_group["Core%d/Galaxies" % i_core]
-            core_ngals = galaxies.size
-
-            if core_ngals > 0:
-                if indices is None:
-                    dest_sel = np.s_[counter : core_ngals + counter]
-                    galaxies.read_direct(G, dest_sel=dest_sel)
-
-                    __apply_offsets(G, dest_sel, counter)
-                    counter += core_ngals
-
-                else:
-                    read_ind = (
-                        np.compress((indices >= total_read) & (indices < total_read + core_ngals), indices,)
-                        - total_read
-                    )
+        for galaxies, source_sel, dest_sel, offset in _gal_read_plan(snap_group, offsets, ngals, indices, rdcc_nbytes):
+            _read_sel(galaxies, G, source_sel, dest_sel)
+            # Deal with any indices that need offsets applied
+            if "CentralGal" in G.dtype.names:
+                _apply_offset(G["CentralGal"][dest_sel], offset)
 
-                    if read_ind.shape[0] > 0:
-                        dest_sel = np.s_[counter : read_ind.shape[0] + counter]
-                        bool_sel = np.zeros(core_ngals, "bool")
-                        bool_sel[read_ind] = True
-                        G[dest_sel] = galaxies[G.dtype.names][bool_sel]
-
-                        __apply_offsets(G, dest_sel, total_read)
-                        counter += read_ind.shape[0]
-
-                    total_read += core_ngals
-
-            if counter >= ngals:
-                break
+    # The galaxies are read in their on-disk byte order (a straight copy for
+    # HDF5) and any byte swapping to native order is left to NumPy.
+    G = _to_native(G)
 
     # Print some checking statistics
     logger.info("Read in %d galaxies." % len(G))
@@ -223,30 +503,20 @@ def read_gals(
     # Apply any Hubble scalings
     if h is not None:
         h = float(h)
-        h_conv = units["HubbleConversions"]
         logger.info("Scaling galaxy properties to h = %.3f" % h)
-        for p in gal_dtype.names:
-            try:
-                conversion = h_conv[p]
-            except KeyError:
-                logger.warn("Unrecognised galaxy property %s - assuming no " "scaling with Hubble const!" % p)
-            if conversion.lower() != "none":
-                try:
-                    G[p] = eval(conversion, dict(v=G[p], h=h, log10=np.log10, __builtins__={}))
-                except:
-                    logger.error("Failed to parse conversion string `%s` for unit" " %s" % (conversion, p))
+        _apply_h_conversions(G, units["HubbleConversions"], h)
 
     # If requested convert the numpy array into a pandas dataframe
     if pandas:
         logger.info("Converting to pandas DataFrame...")
         G = ndarray_to_dataframe(G)
-        regex = re.compile("_\d*$")
+        regex = re.compile(r"_\d*$")
         # attach the units to each column
         for k in G.columns:
             try:
                 G[k].unit = units[re.sub(regex, "", k, 1)]
             except KeyError:
-                logger.warn("Unrecognised galaxy property %s - assuming " "dimensionless quantitiy!" % k)
+                logger.warning("Unrecognised galaxy property %s - assuming " "dimensionless quantitiy!" % k)
     # else convert to astropy table and attach units
     elif table:
         logger.info("Converting to astropy Table...")
@@ -255,11 +525,11 @@ def read_gals(
             try:
                 v.unit = units[k]
             except KeyError:
-                logger.warn("Unrecognised galaxy property %s - assuming " "dimensionless quantitiy!" % k)
+                logger.warning("Unrecognised galaxy property %s - assuming " "dimensionless quantitiy!" % k)
 
     # Set some run properties
     if sim_props:
-        properties = read_input_params(fname, h=h)
+        properties = read_input_params(fin, h=h)
         properties["Redshift"] = snap_group.attrs["Redshift"]
 
     fin.close()
@@ -270,14 +540,195 @@ def read_gals(
         return G
 
 
-def read_input_params(fname, h=None, raw=False):
-    """ Read in the input parameters from a Meraxes hdf5 output file.
+def read_gals_soa(fname, snapshot=None, props=None, h=None, indices=None, pandas=False, rdcc_nbytes=None):
+
+    """Read in galaxies from a Meraxes hdf5 output file as a dict of
+    per-property arrays.
+
+    Unlike `read_gals`, each requested property is read from the file on its
+    own, so only the bytes of the requested properties are transferred.  This
+    is much cheaper than `read_gals` when only a few of the many available
+    properties are needed.
 
     Parameters
     ----------
     fname : str
         Full path to input hdf5 master file.
 
+    snapshot : int
+        The snapshot to read in.  (default: last present snapshot - usually
+        z=0)
+
+    props : list
+        A list of galaxy properties requested.  (default: All properties)
+
+    h : float
+        Hubble constant (/100) to scale the galaxy properties to.  If
+        `None` then no scaling is made unless `set_little_h` was previously
+        called.  (default = None)
+
+    indices : list or array
+        Indices of galaxies to be read.  If `None` then read all galaxies.
+        (default = None)
+
+    pandas : bool
+        Return a pandas DataFrame wrapping the per-property arrays, with
+        each dimension of vector properties as its own column (as in
+        `read_gals`).  (default = False)
+
+    rdcc_nbytes : int
+        Size in bytes of the HDF5 chunk cache used for each galaxy dataset.
+        This only matters for chunked (e.g. compressed) output files, where
+        a cache too small to hold a core's galaxies means chunks are read
+        and decompressed again on every pass over them.  (default = 256 MB)
+
+    Returns
+    -------
+    dict or DataFrame
+        A contiguous array for each requested property, keyed by property
+        name.
+    """
+
+    if (h is None) and (__meraxes_h is not None):
+        h = __meraxes_h
+
+    if pandas:
+        _check_pandas()
+
+    with h5.File(fname, "r") as fin:
+
+        # Set the snapshot correctly
+        if snapshot is None:
+            snapshot = -1
+        if snapshot < 0:
+            snapshot = _list_snaps(fin)[snapshot]
+
+        logger.info("Reading snapshot %d" % snapshot)
+
+        snap_group = fin["Snap%03d" % (snapshot)]
+        offsets = _core_offsets(fin, snapshot)
+        ngals = snap_group.attrs["NGalaxies"][0]
+
+        if ngals == 0:
+            raise IndexError("There are no galaxies in snapshot {:d}!".format(snapshot))
+
+        if indices is not None:
+            indices = _sorted_indices(indices)
+            ngals = indices.shape[0]
+
+        gal_dtype = _gal_dtype(snap_group, props)
+
+        # Each property gets its own single field buffer.  Reading into these
+        # makes HDF5 pick out just that member of the compound type, and the
+        # field of a single field array is contiguous in memory.
+        buffers = {p: np.empty(ngals, dtype=[(p, gal_dtype.fields[p][0])]) for p in gal_dtype.names}
+
+        if ngals > 0:
+            for galaxies, source_sel, dest_sel, offset in _gal_read_plan(snap_group, offsets, ngals, indices, rdcc_nbytes):
+                for buf in buffers.values():
+                    _read_sel(galaxies, buf, source_sel, dest_sel)
+                if "CentralGal" in buffers:
+                    _apply_offset(buffers["CentralGal"]["CentralGal"][dest_sel], offset)
+
+    # Swap any non-native byte order properties here (see read_gals)
+    G = {p: _to_native(buf[p]) for p, buf in buffers.items()}
+    logger.info("Read in %d galaxies." % ngals)
+
+    # Apply any Hubble scalings
+    if h is not None:
+        h = float(h)
+        logger.info("Scaling galaxy properties to h = %.3f" % h)
+        _apply_h_conversions(G, read_units(fname)["HubbleConversions"], h)
+
+    if pandas:
+        # The 1D properties are already contiguous and can be wrapped as
+        # they are.  Vector properties are split into one column per
+        # dimension, placed after all of the 1D columns.
+        cols = {p: v for p, v in G.items() if v.ndim == 1}
+        for p, v in G.items():
+            if v.ndim == 2:
+                sub = np.ascontiguousarray(v.T)
+                cols.update({p + "_%d" % i: sub[i] for i in range(sub.shape[0])})
+        G = pd.DataFrame(cols, copy=False)
+
+    return G
+
+
+@lru_cache(maxsize=None)
+def _compile_h_conversion(conversion):
+    # Conversion strings are parsed once and then reused by every property
+    # (and every call) which shares them.
+    return compile(conversion, "<HubbleConversion>", "eval")
+
+
+@lru_cache(maxsize=None)
+def _inplace_h_conversion(conversion):
+    # Recognise the common literal conversion strings which just scale or
+    # shift v (`v/h`, `v*h**2`, `v+5.0*log10(h)`, ...) and return a function
+    # applying the conversion to v in place, without a temporary array.  The
+    # same operations are done with the same scalars as when the string is
+    # evaluated, so the results are identical.  Returns None for any other
+    # conversion string.
+    m = _match_h_power(conversion)
+    if m:
+        op = np.multiply if m.group(1) == "*" else np.divide
+        if m.group(2) is None:
+            return lambda v, h: op(v, h, out=v, casting="unsafe")
+        power = float(m.group(2)) if "." in m.group(2) else int(m.group(2))
+        return lambda v, h: op(v, h ** power, out=v, casting="unsafe")
+
+    m = _match_h_log(conversion)
+    if m:
+        op = np.add if m.group(1) == "+" else np.subtract
+        coeff = float(m.group(2)) if "." in m.group(2) else int(m.group(2))
+        return lambda v, h: op(v, coeff * np.log10(h), out=v, casting="unsafe")
+
+    return None
+
+
+def _h_conversion_plan(h_conv, names):
+    # Group the requested properties by their Hubble conversion string,
+    # dropping any which don't scale with h.
+    plan = {}
+    for p in names:
+        try:
+            conversion = h_conv[p]
+        except KeyError:
+            logger.warning("Unrecognised galaxy property %s - assuming no " "scaling with Hubble const!" % p)
+            continue
+        if conversion.lower() != "none":
+            plan.setdefault(conversion, []).append(p)
+    return plan
+
+
+def _apply_h_conversions(G, h_conv, h):
+    # Apply the Hubble conversion strings stored in the master file to each
+    # property of G (in place).  G can be a structured array or a dict of
+    # arrays.
+    names = G.dtype.names if isinstance(G, np.ndarray) else list(G)
+    env = dict(h=h, log10=np.log10, __builtins__={})
+    for conversion, props in _h_conversion_plan(h_conv, names).items():
+        try:
+            inplace = _inplace_h_conversion(conversion)
+            code = _compile_h_conversion(conversion)
+            for p in props:
+                if inplace is not None:
+                    inplace(G[p], h)
+                else:
+                    env["v"] = G[p]
+                    G[p][...] = eval(code, env)
+        except:
+            logger.error("Failed to parse conversion string `%s` for unit" " %s" % (conversion, ", ".join(props)))
+
+
+def read_input_params(fname, h=None, raw=False):
+    """ Read in the input parameters from a Meraxes hdf5 output file.
+
+    Parameters
+    ----------
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
+
     h : float
         Hubble constant (/100) to scale the galaxy properties to.  If
         `None` then no scaling is made unless `set_little_h` was previously
@@ -296,45 +747,40 @@ def read_input_params(fname, h=None, raw=False):
         h = __meraxes_h
 
     def arr_to_value(d):
-        for k, v in list(d.items()):
-            if isinstance(v, np.bytes_):
-                d[k] = str(v.astype(np.str_))
-            elif v.size == 1:
-                try:
-                    d[k] = v[0]
-                except IndexError:
-                    d[k] = v
+        d.update(
+            {
+                k: str(v.astype(np.str_)) if isinstance(v, np.bytes_) else v.item()
+                for k, v in d.items()
+                if isinstance(v, np.bytes_) or v.size == 1
+            }
+        )
 
     def visitfunc(name, obj):
         if isinstance(obj, h5.Group):
-            props_dict[name] = dict(list(obj.attrs.items()))
+            props_dict[name] = dict(obj.attrs.items())
             arr_to_value(props_dict[name])
 
     logger.info("Reading input params...")
 
-    # Open the file for reading
-    fin = h5.File(fname, "r")
+    with _open(fname) as fin:
+        group = fin["InputParams"]
 
-    group = fin["InputParams"]
+        props_dict = dict(group.attrs.items())
+        arr_to_value(props_dict)
+        group.visititems(visitfunc)
 
-    props_dict = dict(list(group.attrs.items()))
-    arr_to_value(props_dict)
-    group.visititems(visitfunc)
+        # Update some properties
+        if h is not None:
+            logger.info("Scaling params to h = %.3f" % h)
+            props_dict["BoxSize"] /= h
+            props_dict["PartMass"] /= h
 
-    # Update some properties
-    if h is not None:
-        logger.info("Scaling params to h = %.3f" % h)
-        props_dict["BoxSize"] = group.attrs["BoxSize"][0] / h
-        props_dict["PartMass"] = group.attrs["PartMass"][0] / h
+        # Add extra props
+        if not raw:
+            props_dict["Volume"] = props_dict["BoxSize"] ** 3.0 * props_dict["VolumeFactor"]
 
-    # Add extra props
-    if not raw:
-        props_dict["Volume"] = props_dict["BoxSize"] ** 3.0 * props_dict["VolumeFactor"]
-
-        info = read_git_info(fname)
-        props_dict.update({"model_git_ref": info[0], "model_git_diff": info[1]})
-
-    fin.close()
+            info = read_git_info(fin)
+            props_dict.update({"model_git_ref": info[0], "model_git_diff": info[1]})
 
     return props_dict
 
@@ -345,8 +791,8 @@ def read_units(fname):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file.
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     Returns
     -------
@@ -356,22 +802,20 @@ def read_units(fname):
     """
 
     def arr_to_value(d):
-        for k, v in d.items():
-            if type(v) is np.ndarray and v.size == 1:
-                d[k] = v[0]
+        d.update({k: v.item() for k, v in d.items() if type(v) is np.ndarray and v.size == 1})
 
     def visitunits(name, obj):
         if isinstance(obj, h5.Group):
-            units_dict[name] = dict(list(obj.attrs.items()))
+            units_dict[name] = dict(obj.attrs.items())
             arr_to_value(units_dict[name])
 
     def visitconv(name, obj):
         if isinstance(obj, h5.Group):
-            hubble_conv_dict[name] = dict(list(obj.attrs.items()))
+            hubble_conv_dict[name] = dict(obj.attrs.items())
             arr_to_value(hubble_conv_dict[name])
 
     def sanitize_dict_strings(d):
-        regex = re.compile("(\D\.\S*)|(__.*__)|(__)")
+        regex = re.compile(r"(\D\.\S*)|(__.*__)|(__)")
         for k, v in d.items():
             if type(v) is dict:
                 sanitize_dict_strings(v)
@@ -381,20 +825,18 @@ def read_units(fname):
 
     logger.info("Reading units...")
 
-    # Open the file for reading
-    fin = h5.File(fname, "r")
-
-    # Read the units
-    for name in ["Units", "HubbleConversions"]:
-        group = fin[name]
-        if name == "Units":
-            units_dict = dict(list(group.attrs.items()))
-            arr_to_value(units_dict)
-            group.visititems(visitunits)
-        if name == "HubbleConversions":
-            hubble_conv_dict = dict(list(group.attrs.items()))
-            arr_to_value(hubble_conv_dict)
-            group.visititems(visitconv)
+    with _open(fname) as fin:
+        # Read the units
+        for name in ["Units", "HubbleConversions"]:
+            group = fin[name]
+            if name == "Units":
+                units_dict = dict(group.attrs.items())
+                arr_to_value(units_dict)
+                group.visititems(visitunits)
+            if name == "HubbleConversions":
+                hubble_conv_dict = dict(group.attrs.items())
+                arr_to_value(hubble_conv_dict)
+                group.visititems(visitconv)
 
     # Sanitize the hubble conversions
     sanitize_dict_strings(hubble_conv_dict)
@@ -402,8 +844,6 @@ def read_units(fname):
     # Put the hubble conversions information inside the units dict for ease
     units_dict["HubbleConversions"] = hubble_conv_dict
 
-    fin.close()
-
     return units_dict
 
 
@@ -412,8 +852,8 @@ def read_git_info(fname):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file.
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     Returns
     -------
@@ -424,7 +864,7 @@ def read_git_info(fname):
         git diff of the model
     """
 
-    with h5.File(fname, "r") as fin:
+    with _open(fname) as fin:
         gitdiff = fin["gitdiff"][()]
         gitref = fin["gitdiff"].attrs["gitref"].copy()
 
@@ -437,8 +877,8 @@ def read_snaplist(fname, h=None):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file.
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     h : float
         Hubble constant (/100) to scale the galaxy properties to.  If
@@ -464,14 +904,13 @@ def read_snaplist(fname, h=None):
     snaplist = []
     lt_times = []
 
-    with h5.File(fname, "r") as fin:
-        for snap in list(fin.keys()):
-            try:
-                zlist.append(fin[snap].attrs["Redshift"][0])
-                snaplist.append(int(snap[-3:]))
-                lt_times.append(fin[snap].attrs["LTTime"][0])
-            except KeyError:
-                pass
+    with _open(fname) as fin:
+        for snap, name in _snap_names(fin):
+            attrs = fin[name].attrs
+            if "Redshift" in attrs and "LTTime" in attrs:
+                zlist.append(attrs["Redshift"][0])
+                snaplist.append(snap)
+                lt_times.append(attrs["LTTime"][0])
 
     lt_times = np.array(lt_times, dtype=float)
     if h is not None:
@@ -487,8 +926,8 @@ def check_for_redshift(fname, redshift, tol=0.1):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     redshift : float
         Redshift value
@@ -565,8 +1004,8 @@ def grab_redshift(fname, snapshot):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     snapshot : int
         Snapshot for which the redshift is to grabbed
@@ -577,12 +1016,9 @@ def grab_redshift(fname, snapshot):
         Corresponding redshift value
     """
 
-    with h5.File(fname, "r") as fin:
+    with _open(fname) as fin:
         if snapshot < 0:
-            present_snaps = np.asarray(list(fin.keys()))
-            selection = np.array([(p.find("Snap") == 0) for p in present_snaps])
-            present_snaps = [int(p[4:]) for p in present_snaps[selection]]
-            snapshot = sorted(present_snaps)[snapshot]
+            snapshot = _list_snaps(fin)[snapshot]
         redshift = fin["Snap{:03d}".format(snapshot)].attrs["Redshift"][0]
 
     return redshift
@@ -595,8 +1031,8 @@ def grab_unsampled_snapshot(fname, snapshot):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     snapshot : int
         Snapshot for which the unsampled value is to be grabbed
@@ -607,12 +1043,55 @@ def grab_unsampled_snapshot(fname, snapshot):
         Corresponding unsampled snapshot value
     """
 
-    with h5.File(fname, "r") as fin:
+    with _open(fname) as fin:
         redshift = fin["Snap{:03d}".format(snapshot)].attrs["UnsampledSnapshot"][0]
 
     return redshift
 
 
+@lru_cache(maxsize=_INDEX_CACHE_SIZE)
+def _read_firstprogenitor_indices(fname, mtime, snapshot):
+    # Cached worker for `read_firstprogenitor_indices`.  `mtime` is only used
+    # as part of the cache key so that rewritten files are re-read.
+
+    with h5.File(fname, "r") as fin:
+
+        # number of cores used for this run
+        n_cores = fin.attrs["NCores"][0]
+
+        # group in the master file for this snapshot
+        snap_group = fin["Snap{:03d}".format(snapshot)]
+
+        # number of galaxies in this snapshot
+        n_gals = snap_group.attrs["NGalaxies"][0]
+
+        # malloc the fp_ind array and an array that will hold offsets for
+        # each core
+        fp_ind = np.zeros(n_gals, "i4")
+        prev_core_counter = _core_offsets(fin, snapshot - 1)[:-1]
+
+        # loop through and read in the FirstProgenitorIndices for each core,
+        # recording how many values came from each.
+        core_nvals = np.zeros(n_cores, "i8")
+        counter = 0
+        for i_core in range(n_cores):
+            ds = snap_group[f"Core{i_core}/FirstProgenitorIndices"]
+            core_nvals[i_core] = ds.size
+            if core_nvals[i_core] > 0:
+                ds.read_direct(fp_ind, dest_sel=np.s_[counter : core_nvals[i_core] + counter])
+                counter += core_nvals[i_core]
+        core_id = np.repeat(np.arange(n_cores, dtype="i4"), core_nvals)
+
+        # update the values to reflect that we are making one big array from
+        # the output of all cores. Be sure *not* to update fp indices that =
+        # -1.  This has special meaning!
+        _apply_core_offsets(fp_ind, core_id, prev_core_counter)
+
+    fp_ind.setflags(write=False)
+
+    return fp_ind
+
+
 def read_firstprogenitor_indices(fname, snapshot, pandas=False):
 
     """ Read the FirstProgenitor indices from the Meraxes HDF5 file.
@@ -633,11 +1112,29 @@ def read_firstprogenitor_indices(fname, snapshot, pandas=False):
     -------
     fp_ind : array or series
         FirstProgenitor indices
+
+    Notes
+    -----
+    The indices are cached per (file, modification time, snapshot) and the
+    returned array is read-only.  Take a copy if you need to modify it.
     """
 
     if pandas:
         _check_pandas()
 
+    fp_ind = _read_firstprogenitor_indices(os.fspath(fname), os.path.getmtime(fname), snapshot)
+
+    if pandas:
+        fp_ind = pd.Series(fp_ind)
+
+    return fp_ind
+
+
+@lru_cache(maxsize=_INDEX_CACHE_SIZE)
+def _read_nextprogenitor_indices(fname, mtime, snapshot):
+    # Cached worker for `read_nextprogenitor_indices`.  `mtime` is only used
+    # as part of the cache key so that rewritten files are re-read.
+
     with h5.File(fname, "r") as fin:
 
         # number of cores used for this run
@@ -646,41 +1143,36 @@ def read_firstprogenitor_indices(fname, snapshot, pandas=False):
         # group in the master file for this snapshot
         snap_group = fin["Snap{:03d}".format(snapshot)]
 
-        # group for the previous snapshot
-        prev_snap_group = fin["Snap{:03d}".format(snapshot - 1)]
-
         # number of galaxies in this snapshot
         n_gals = snap_group.attrs["NGalaxies"][0]
 
-        # malloc the fp_ind array and an array that will hold offsets for
-        # each core
-        fp_ind = np.zeros(n_gals, "i4")
-        prev_core_counter = np.zeros(n_cores, "i4")
-
-        # calculate the offsets for each core
-        prev_core_counter[0] = 0
-        for i_core in range(n_cores - 1):
-            prev_core_counter[i_core + 1] = prev_snap_group["Core{:d}/Galaxies".format(i_core)].size
-        prev_core_counter = np.cumsum(prev_core_counter)
-
-        # loop through and read in the FirstProgenitorIndices for each core. Be
-        # sure to update the value to reflect that we are making one big array
-        # from the output of all cores. Also be sure *not* to update fp indices
-        # that = -1.  This has special meaning!
+        # malloc the np_ind array
+        np_ind = np.zeros(n_gals, "i4")
+
+        # malloc an array that will hold the offset for each core
+        core_counter = np.zeros(n_cores, "i4")
+
+        # loop through and read in the NextProgenitorIndices for each core,
+        # recording how many values came from each.
+        core_nvals = np.zeros(n_cores, "i8")
         counter = 0
         for i_core in range(n_cores):
-            ds = snap_group["Core{:d}/FirstProgenitorIndices".format(i_core)]
-            core_nvals = ds.size
-            if core_nvals > 0:
-                dest_sel = np.s_[counter : core_nvals + counter]
-                ds.read_direct(fp_ind, dest_sel=dest_sel)
-                counter += core_nvals
-                fp_ind[dest_sel][fp_ind[dest_sel] > -1] += prev_core_counter[i_core]
+            ds = snap_group[f"Core{i_core}/NextProgenitorIndices"]
+            core_nvals[i_core] = ds.size
+            core_counter[i_core] = counter
+            if core_nvals[i_core] > 0:
+                ds.read_direct(np_ind, dest_sel=np.s_[counter : core_nvals[i_core] + counter])
+                counter += core_nvals[i_core]
+        core_id = np.repeat(np.arange(n_cores, dtype="i4"), core_nvals)
 
-    if pandas:
-        fp_ind = pd.Series(fp_ind)
+        # update the values to reflect that we are making one big array from
+        # the output of all cores. Be sure *not* to update np indices that =
+        # -1.  This has special meaning!
+        _apply_core_offsets(np_ind, core_id, core_counter)
 
-    return fp_ind
+    np_ind.setflags(write=False)
+
+    return np_ind
 
 
 def read_nextprogenitor_indices(fname, snapshot, pandas=False):
@@ -702,11 +1194,29 @@ def read_nextprogenitor_indices(fname, snapshot, pandas=False):
     -------
     np_ind : array
         NextProgenitor indices
+
+    Notes
+    -----
+    The indices are cached per (file, modification time, snapshot) and the
+    returned array is read-only.  Take a copy if you need to modify it.
     """
 
     if pandas:
         _check_pandas()
 
+    np_ind = _read_nextprogenitor_indices(os.fspath(fname), os.path.getmtime(fname), snapshot)
+
+    if pandas:
+        np_ind = pd.Series(np_ind)
+
+    return np_ind
+
+
+@lru_cache(maxsize=_INDEX_CACHE_SIZE)
+def _read_descendant_indices(fname, mtime, snapshot):
+    # Cached worker for `read_descendant_indices`.  `mtime` is only used
+    # as part of the cache key so that rewritten files are re-read.
+
     with h5.File(fname, "r") as fin:
 
         # number of cores used for this run
@@ -718,27 +1228,31 @@ def read_nextprogenitor_indices(fname, snapshot, pandas=False):
         # number of galaxies in this snapshot
         n_gals = snap_group.attrs["NGalaxies"][0]
 
-        # malloc the np_ind array
-        np_ind = np.zeros(n_gals, "i4")
+        # malloc the desc_ind array and an array that will hold offsets for
+        # each core
+        desc_ind = np.zeros(n_gals, "i4")
+        prev_core_counter = _core_offsets(fin, snapshot + 1)[:-1]
 
-        # loop through and read in the NextProgenitorIndices for each core. Be
-        # sure to update the value to reflect that we are making one big array
-        # from the output of all cores. Also be sure *not* to update np indices
-        # that = -1.  This has special meaning!
+        # loop through and read in the DescendantIndices for each core,
+        # recording how many values came from each.
+        core_nvals = np.zeros(n_cores, "i8")
         counter = 0
         for i_core in range(n_cores):
-            ds = snap_group["Core{:d}/NextProgenitorIndices".format(i_core)]
-            core_nvals = ds.size
-            if core_nvals > 0:
-                dest_sel = np.s_[counter : core_nvals + counter]
-                ds.read_direct(np_ind, dest_sel=dest_sel)
-                np_ind[dest_sel][np_ind[dest_sel] > -1] += counter
-                counter += core_nvals
+            ds = snap_group[f"Core{i_core}/DescendantIndices"]
+            core_nvals[i_core] = ds.size
+            if core_nvals[i_core] > 0:
+                ds.read_direct(desc_ind, dest_sel=np.s_[counter : core_nvals[i_core] + counter])
+                counter += core_nvals[i_core]
+        core_id = np.repeat(np.arange(n_cores, dtype="i4"), core_nvals)
 
-    if pandas:
-        np_ind = pd.Series(np_ind)
+        # update the values to reflect that we are making one big array from
+        # the output of all cores. Be sure *not* to update desc indices that =
+        # -1.  This has special meaning!
+        _apply_core_offsets(desc_ind, core_id, prev_core_counter)
 
-    return np_ind
+    desc_ind.setflags(write=False)
+
+    return desc_ind
 
 
 def read_descendant_indices(fname, snapshot, pandas=False):
@@ -760,54 +1274,70 @@ def read_descendant_indices(fname, snapshot, pandas=False):
     -------
     desc_ind : array
         NextProgenitor indices
+
+    Notes
+    -----
+    The indices are cached per (file, modification time, snapshot) and the
+    returned array is read-only.  Take a copy if you need to modify it.
     """
 
     if pandas:
         _check_pandas()
 
-    with h5.File(fname, "r") as fin:
+    desc_ind = _read_descendant_indices(os.fspath(fname), os.path.getmtime(fname), snapshot)
 
-        # number of cores used for this run
-        n_cores = fin.attrs["NCores"][0]
+    if pandas:
+        desc_ind = pd.Series(desc_ind)
 
-        # group in the master file for this snapshot
-        snap_group = fin["Snap{:03d}".format(snapshot)]
+    return desc_ind
 
-        # group for the next snapshot
-        next_snap_group = fin["Snap{:03d}".format(snapshot + 1)]
 
-        # number of galaxies in this snapshot
-        n_gals = snap_group.attrs["NGalaxies"][0]
+def _locate_galaxy(fin, snapshot, global_ind):
+    # Translate a global galaxy index into (core, index within that core).
+    offsets = _core_offsets(fin, snapshot)
+    i_core = int(np.searchsorted(offsets, global_ind, side="right")) - 1
+    return i_core, int(global_ind - offsets[i_core])
 
-        # malloc the desc_ind array and an array that will hold offsets for
-        # each core
-        desc_ind = np.zeros(n_gals, "i4")
-        prev_core_counter = np.zeros(n_cores, "i4")
-
-        # calculate the offsets for each core
-        prev_core_counter[0] = 0
-        for i_core in range(n_cores - 1):
-            prev_core_counter[i_core + 1] = next_snap_group["Core{:d}/Galaxies".format(i_core)].size
-        prev_core_counter = np.cumsum(prev_core_counter)
-
-        # loop through and read in the DescendantIndices for each core. Be sure
-        # to update the value to reflect that we are making one big array from
-        # the output of all cores. Also be sure *not* to update desc indices
-        # that = -1.  This has special meaning!
-        counter = 0
-        for i_core in range(n_cores):
-            ds = snap_group["Core{:d}/DescendantIndices".format(i_core)]
-            core_nvals = ds.size
-            if core_nvals > 0:
-                dest_sel = np.s_[counter : core_nvals + counter]
-                ds.read_direct(desc_ind, dest_sel=dest_sel)
-                counter += core_nvals
-                desc_ind[dest_sel][desc_ind[dest_sel] > -1] += prev_core_counter[i_core]
 
-    if pandas:
-        desc_ind = pd.Series(desc_ind)
+def _read_one_index(fin, snapshot, global_ind, ds_name, target_snapshot):
+    # Read a single progenitor/descendant index and convert it to a global
+    # index into `target_snapshot`.  Indices that = -1 are left untouched.
+    i_core, local_ind = _locate_galaxy(fin, snapshot, global_ind)
+    ind = int(fin[f"Snap{snapshot:03d}/Core{i_core}/{ds_name}"][local_ind])
+    if ind > -1:
+        ind += int(_core_offsets(fin, target_snapshot)[i_core])
+    return ind
+
+
+def _read_one_fp_index(fin, snapshot, global_ind):
+    # Read the global FirstProgenitor index of a single galaxy.
+    return _read_one_index(fin, snapshot, global_ind, "FirstProgenitorIndices", snapshot - 1)
+
+
+def _read_one_desc_index(fin, snapshot, global_ind):
+    # Read the global Descendant index of a single galaxy.
+    return _read_one_index(fin, snapshot, global_ind, "DescendantIndices", snapshot + 1)
 
-    return desc_ind
+
+def _read_one_gal(fin, snapshot, global_ind, gal_dtype, h_conv, h=None):
+    # Read a single galaxy, applying the offsets and Hubble scalings as in
+    # `read_gals`.
+    h = _little_h(h)
+
+    i_core, local_ind = _locate_galaxy(fin, snapshot, global_ind)
+    offsets = _core_offsets(fin, snapshot)
+
+    G = np.empty(1, dtype=gal_dtype)
+    galaxies = fin[f"Snap{snapshot:03d}/Core{i_core}/Galaxies"]
+    galaxies.read_direct(G, source_sel=np.s_[local_ind : local_ind + 1])
+
+    if "CentralGal" in G.dtype.names:
+        _apply_offset(G["CentralGal"], offsets[i_core])
+
+    if h is not None:
+        _apply_h_conversions(G, h_conv, float(h))
+
+    return G[0]
 
 
 def read_grid(fname, snapshot, name, h=None, h_scaling={}):
@@ -816,8 +1346,8 @@ def read_grid(fname, snapshot, name, h=None, h_scaling={}):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     snapshot : int
         Snapshot from which the grid is to be read from.
@@ -844,16 +1374,25 @@ def read_grid(fname, snapshot, name, h=None, h_scaling={}):
     if (h is None) and (__meraxes_h is not None):
         h = __meraxes_h
 
-    with h5.File(fname, "r") as fin:
+    with _open(fname) as fin:
         try:
             grid_dim = fin["InputParams"].attrs["ReionGridDim"][0]
         except KeyError:
             grid_dim = fin["InputParams"].attrs["TOCF_HII_dim"][0]
         ds_name = "Snap{:03d}/Grids/{:s}".format(snapshot, name)
         try:
-            grid = fin[ds_name][:]
+            ds = fin[ds_name]
         except KeyError:
             logger.error("No grid called %s found in file %s ." % (name, fname))
+        else:
+            # Grids are stored flattened, so read them straight into the
+            # final 3D array (HDF5 doesn't check that the buffer fits)
+            if ds.size != grid_dim ** 3:
+                raise ValueError(
+                    "Grid %s has %d cells, which doesn't match a grid dimension of %d." % (name, ds.size, grid_dim)
+                )
+            grid = np.empty([grid_dim,] * 3, dtype=ds.dtype)
+            ds.id.read(h5s.ALL, h5s.ALL, grid)
 
     # Apply any Hubble scalings
     if h is not None:
@@ -865,7 +1404,7 @@ def read_grid(fname, snapshot, name, h=None, h_scaling={}):
         try:
             conversion = h_conv[name]
         except KeyError:
-            logger.warn("Unknown scaling for grid %s - assuming no " "scaling with Hubble const!" % name)
+            logger.warning("Unknown scaling for grid %s - assuming no " "scaling with Hubble const!" % name)
             conversion = "None"
 
         if conversion.lower() != "none":
@@ -874,8 +1413,6 @@ def read_grid(fname, snapshot, name, h=None, h_scaling={}):
             except:
                 logger.error("Failed to parse conversion string `%s` for unit" " %s" % (conversion, name))
 
-    grid.shape = [grid_dim,] * 3
-
     return grid
 
 
@@ -885,8 +1422,8 @@ def list_grids(fname, snapshot):
 
     Parameters
     ----------
-    fname : str
-        Full path to input hdf5 master file
+    fname : str or h5py.File
+        Full path to input hdf5 master file, or the already open file.
 
     snapshot : int
         Snapshot for which the grids are to be listed.
@@ -897,7 +1434,7 @@ def list_grids(fname, snapshot):
         A list of the available grids
     """
 
-    with h5.File(fname, "r") as fin:
+    with _open(fname) as fin:
         group_name = "Snap{:03d}/Grids".format(snapshot)
         try:
             grids = list(k for k, v in fin[group_name].items() if len(v.shape) == 3)
@@ -1017,17 +1554,18 @@ def read_global_xH(fname, snapshot, weight="volume"):
         for ii, snap in enumerate(snapshot):
             ds_name = "Snap{:03d}/Grids/xH".format(snap)
             try:
-                global_xH[ii] = fin[ds_name].attrs[prop][0]
+                attrs = fin[ds_name].attrs
             except KeyError:
-                if weight == "volume":
-                    # This case deals with old style Meraxes file outputs
-                    try:
-                        global_xH[ii] = fin[ds_name].attrs["global_xH"][0]
-                    except KeyError:
-                        pass
-                    else:
-                        continue
+                attrs = {}
 
+            val = attrs.get(prop)
+            if (val is None) and (weight == "volume"):
+                # This case deals with old style Meraxes file outputs
+                val = attrs.get("global_xH")
+
+            if val is not None:
+                global_xH[ii] = val[0]
+            else:
                 global_xH[ii] = np.nan
                 logger.warning("No global_xH found for snapshot %d in file %s" % (snap, fname))
 
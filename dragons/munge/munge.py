@@ -3,18 +3,149 @@
 
 """A collection of functions for doing common processing tasks."""
 
+import hashlib
+import os
 import re
 import numpy as np
 from pandas import DataFrame
 from scipy.stats import describe as sp_describe
+from astropy.stats import calculate_bin_edges
 from .tophat_filter import tophat_filter
 
 import logging
 
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+try:
+    from numba import njit, prange, get_num_threads
+except ImportError:
+    njit = None
+
 logger = logging.getLogger(__name__)
 logger.setLevel("WARNING")
 
 
+if pyfftw is not None:
+
+    # Keep the FFTW plans alive between calls so that repeated transforms of
+    # the same grid shape don't have to be re-planned.
+    pyfftw.interfaces.cache.enable()
+    pyfftw.interfaces.cache.set_keepalive_time(60)
+    _NTHREADS = os.cpu_count() or 1
+
+    def _rfftn(grid):
+        return pyfftw.interfaces.numpy_fft.rfftn(pyfftw.byte_align(grid), threads=_NTHREADS)
+
+    def _irfftn(grid):
+        return pyfftw.interfaces.numpy_fft.irfftn(pyfftw.byte_align(grid), threads=_NTHREADS)
+
+
+else:
+    _rfftn = np.fft.rfftn
+    _irfftn = np.fft.irfftn
+
+
+def _power_spectrum_sums_numpy(k_bin, k, power_dim, plane_weight, n_bins):
+    # Return the per k bin sums of the mode weights, and of the weighted k,
+    # dimensional power and k^3 * dimensional power, along with the number of
+    # (independent) stored modes.  `plane_weight` is the weight of each mode
+    # along the last (rfftn) axis.
+    weight = np.broadcast_to(plane_weight, (k.size // plane_weight.size, plane_weight.size)).ravel()
+    sums = np.empty((5, n_bins))
+    sums[0] = np.bincount(k_bin, weights=weight, minlength=n_bins)
+    sums[1] = np.bincount(k_bin, weights=weight * k, minlength=n_bins)
+    weight = weight * power_dim
+    sums[2] = np.bincount(k_bin, weights=weight, minlength=n_bins)
+    weight *= k ** 3
+    sums[3] = np.bincount(k_bin, weights=weight, minlength=n_bins)
+    sums[4] = np.bincount(k_bin, minlength=n_bins)
+    return sums
+
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _power_spectrum_sums_kernel(k_bin, k, power_dim, plane_weight, n_bins, n_chunks):
+        # Each chunk of the grid is accumulated into its own set of sums so
+        # that no two threads ever update the same bin.
+        sums = np.zeros((n_chunks, 5, n_bins))
+        n_r = plane_weight.size
+        chunk_size = (k_bin.size + n_chunks - 1) // n_chunks
+        for i_chunk in prange(n_chunks):
+            acc = sums[i_chunk]
+            for ii in range(i_chunk * chunk_size, min((i_chunk + 1) * chunk_size, k_bin.size)):
+                b = k_bin[ii]
+                w = plane_weight[ii % n_r]
+                p = w * power_dim[ii]
+                acc[0, b] += w
+                acc[1, b] += w * k[ii]
+                acc[2, b] += p
+                acc[3, b] += p * k[ii] ** 3
+                acc[4, b] += 1.0
+        return sums.sum(axis=0)
+
+    def _power_spectrum_sums(k_bin, k, power_dim, plane_weight, n_bins):
+        # Single pass equivalent of `_power_spectrum_sums_numpy`.
+        return _power_spectrum_sums_kernel(k_bin, k, power_dim, plane_weight, n_bins, get_num_threads())
+
+    @njit(parallel=True, cache=True)
+    def _tophat_filter_kernel(grid, k, k_r, radius):
+        for ii in prange(k.size):
+            for jj in range(k.size):
+                for kk in range(k_r.size):
+                    kR = np.sqrt(k[ii] * k[ii] + k[jj] * k[jj] + k_r[kk] * k_r[kk]) * radius
+                    # kR = 0 only for the DC mode at [0, 0, 0] (as radius > 0),
+                    # where the window is 1, so it is left untouched rather
+                    # than evaluating 0/0
+                    if kR > 0.0:
+                        grid[ii, jj, kk] *= 3.0 * (np.sin(kR) / kR ** 3 - np.cos(kR) / kR ** 2)
+
+    def _tophat_filter(grid, side_length, radius):
+        # Threaded equivalent of the Cython tophat_filter (which it replaces
+        # when Numba is available).  The grid is modified in place.
+        if radius == 0:
+            return
+        dim = grid.shape[0]
+        k = 2.0 * np.pi * np.fft.fftfreq(dim, 1 / float(dim)) / side_length
+        k_r = 2.0 * np.pi * np.fft.rfftfreq(dim, 1 / float(dim)) / side_length
+        _tophat_filter_kernel(grid, k, k_r, radius)
+
+
+else:
+    _power_spectrum_sums = _power_spectrum_sums_numpy
+
+    def _tophat_filter(grid, side_length, radius):
+        # The Cython kernel only accepts double precision grids, so single
+        # precision ones have to be filtered through a temporary copy.
+        if grid.dtype == np.complex128:
+            tophat_filter(grid, side_length, radius)
+        else:
+            tmp = grid.astype(np.complex128)
+            tophat_filter(tmp, side_length, radius)
+            grid[...] = tmp
+
+
+# Output templates for pretty_print_dict and describe
+_PP_FMT = "{!s:>{w}} :"
+_PP_TITLE_FMT = "\n{!s:>{w}}\n{!s:>{w}}"
+_DESC_FMT = "{:15s} : {:g}"
+
+# Bin edges from the (expensive) astropy bin estimators used by
+# mass_function, keyed on a hash of the data they were calculated from.
+# astropy>=4.3 is required so that the Bayesian blocks fitness is evaluated
+# as N * log(N / T) (one log per cell rather than two).
+_ASTROPY_BINS = ("blocks", "knuth")
+_BIN_CACHE = {}
+_BIN_CACHE_SIZE = 32
+
+# Bayesian blocks is O(N^2) in the number of masses, so larger samples are
+# randomly subsampled to this many before finding the block edges.
+_BLOCKS_MAX_SAMPLE = 50000
+
+
 def pretty_print_dict(d, fmtlen=30):
 
     """Pretty print a dictionary, dealing with recursion.
@@ -28,15 +159,12 @@ def pretty_print_dict(d, fmtlen=30):
         maximum length of dictionary key for print formatting
     """
 
-    fmtstr = "%%%ds :" % fmtlen
-    fmtstr_title = "\n%%%ds\n%%%ds" % (fmtlen, fmtlen)
-
     for k, v in d.items():
         if isinstance(v, dict):
-            print(fmtstr_title % (k.upper(), re.sub("\S", "-", k)))
+            print(_PP_TITLE_FMT.format(k.upper(), re.sub(r"\S", "-", k), w=fmtlen))
             pretty_print_dict(v)
         else:
-            print(fmtstr % k, v)
+            print(_PP_FMT.format(k, w=fmtlen), v)
 
 
 def ndarray_to_dataframe(arr, drop_vectors=False):
@@ -58,28 +186,59 @@ def ndarray_to_dataframe(arr, drop_vectors=False):
         Pandas DataFrame
     """
 
-    # Get a list of all of the columns which are 1D
-    names = []
+    # Collect all of the columns which are 1D, and each dimension of every
+    # N(>1)D property as its own column, in a single pass over the fields.
+    # The vector columns are kept separate so that they still come after all
+    # of the 1D columns.  Each column is copied out of the record array once
+    # into its own contiguous buffer, which pandas can then use as is (and
+    # which doesn't alias `arr`).
+    cols = {}
+    vector_cols = {}
     for k, v in arr.dtype.fields.items():
         if len(v[0].shape) == 0:
-            names.append(k)
-
-    # Create a new dataframe with these columns
-    df = DataFrame(arr[names])
+            cols[k] = np.ascontiguousarray(arr[k])
+        elif not drop_vectors and len(v[0].shape) == 1:
+            sub = np.ascontiguousarray(arr[k].T)
+            vector_cols.update({k + "_%d" % i: sub[i] for i in range(sub.shape[0])})
+    cols.update(vector_cols)
+
+    # Create the dataframe in one go rather than appending columns (which
+    # forces pandas to reallocate its internal blocks each time)
+    return DataFrame(cols, copy=False)
+
+
+def _cached_bin_edges(mass, bins, range):
+    # Return the astropy `bins` estimator edges for `mass`, reusing the
+    # result of any previous call with the same data.  The edges are
+    # read-only as they are shared between calls.
+    mass = np.ascontiguousarray(mass).ravel()
+    key = (bins, None if range is None else tuple(range), mass.dtype.str, hashlib.blake2b(mass).digest())
+
+    try:
+        return _BIN_CACHE[key]
+    except KeyError:
+        pass
+
+    if bins == "blocks" and mass.size > _BLOCKS_MAX_SAMPLE:
+        sample = np.random.default_rng(0).choice(mass, _BLOCKS_MAX_SAMPLE, replace=False)
+        edges = np.asarray(calculate_bin_edges(sample, bins, range), dtype=float)
+        # Make sure the outer edges still include every mass (astropy only
+        # uses `range` to select the data, it doesn't pin the edges to it).
+        # `mass` is sorted and already restricted to `range` by the caller.
+        edges[0], edges[-1] = mass[0], mass[-1]
+    else:
+        edges = np.asarray(calculate_bin_edges(mass, bins, range), dtype=float)
+    edges.setflags(write=False)
 
-    if not drop_vectors:
-        # Loop through each N(>1)D property and append each dimension as
-        # its own column in the dataframe
-        for k, v in arr.dtype.fields.items():
-            if len(v[0].shape) == 1:
-                for i in range(v[0].shape[0]):
-                    df[k + "_%d" % i] = arr[k][:, i]
+    if len(_BIN_CACHE) >= _BIN_CACHE_SIZE:
+        _BIN_CACHE.pop(next(iter(_BIN_CACHE)))
+    _BIN_CACHE[key] = edges
 
-    return df
+    return edges
 
 
 def mass_function(mass, volume, bins, range=None, poisson_uncert=False, return_edges=False, **kwargs):
-    """Generate a mass function.
+    r"""Generate a mass function.
 
     Parameters
     ----------
@@ -90,7 +249,11 @@ def mass_function(mass, volume, bins, range=None, poisson_uncert=False, return_e
         volume of simulation cube/subset
 
     bins : int or list or str
-        passed to numpy.histogram
+        passed to numpy.histogram.  May also be 'blocks' (Bayesian blocks)
+        or 'knuth' (Knuth's rule), in which case the edges are calculated
+        with astropy and cached for repeated calls with the same data.
+        Bayesian blocks edges for more than 50000 masses are found from a
+        random subsample of 50000 of them.
 
     range : len=2 list or array
         range of data to be used for mass function
@@ -113,26 +276,42 @@ def mass_function(mass, volume, bins, range=None, poisson_uncert=False, return_e
     """
 
     if "normed" in kwargs:
-        kwargs["normed"] = False
-        logger.warn("Turned off normed kwarg in mass_function()")
+        # numpy.histogram no longer accepts normed (and we never want it on)
+        del kwargs["normed"]
+        logger.warning("Turned off normed kwarg in mass_function()")
+
+    if isinstance(bins, str) and bins in _ASTROPY_BINS:
+        # The astropy estimators sort their input anyway, so sort up front
+        # and select the range as a contiguous slice rather than with a mask.
+        mass = np.sort(mass, axis=None)
+        if range is not None:
+            mass = mass[np.searchsorted(mass, range[0], "left") : np.searchsorted(mass, range[1], "right")]
+        bins = _cached_bin_edges(mass, bins, range)
+
+    elif range is not None and isinstance(bins, str):
+        sel = mass >= range[0]
+        sel &= mass <= range[1]
+        mass = mass[sel]
+
+    # np.histogram already bins evenly spaced int bins by direct index
+    # calculation rather than a search, and profiles as fast as a hand rolled
+    # np.bincount over the same bins, so it is used for every bin type.
+    vals, edges = np.histogram(mass, bins, range, **kwargs)
 
-    if range is not None and isinstance(bins, str):
-        mass = mass[(mass >= range[0]) & (mass <= range[1])]
+    # the bins need not be evenly spaced (e.g. Bayesian blocks)
+    width = np.diff(edges)
+    centers = edges[:-1] + width / 2.0
+    norm = 1.0 / (volume * width)
 
-    vals, edges = np.histogram(mass, bins, range, **kwargs)
-    width = edges[1] - edges[0]
-    radius = width / 2.0
-    centers = edges[:-1] + radius
+    mf = np.empty((centers.size, 3 if poisson_uncert else 2))
+    mf[:, 0] = centers
+    np.multiply(vals, norm, out=mf[:, 1])
     if poisson_uncert:
-        uncert = np.sqrt(vals.astype(float))
-
-    vals = vals.astype(float) / (volume * width)
+        np.sqrt(vals, out=mf[:, 2])
+        mf[:, 2] *= norm
 
-    if not poisson_uncert:
-        mf = np.dstack((centers, vals)).squeeze()
-    else:
-        uncert /= volume * width
-        mf = np.dstack((centers, vals, uncert)).squeeze()
+    # a single bin comes back as a 1D array
+    mf = mf.squeeze()
 
     if not return_edges:
         return mf
@@ -173,7 +352,7 @@ def edges_to_centers(edges, width=False):
 
 def describe(arr, **kwargs):
 
-    """Run scipy.stats.describe and produce legible output.
+    r"""Run scipy.stats.describe and produce legible output.
 
     Parameters
     ----------
@@ -190,18 +369,18 @@ def describe(arr, **kwargs):
 
     stats = sp_describe(arr)
 
-    print(("{:15s} : {:g}".format("size", stats[0])))
-    print(("{:15s} : {:g}".format("min", stats[1][0])))
-    print(("{:15s} : {:g}".format("max", stats[1][1])))
-    print(("{:15s} : {:g}".format("mean", stats[2])))
-    print(("{:15s} : {:g}".format("unbiased var", stats[3])))
-    print(("{:15s} : {:g}".format("biased skew", stats[4])))
-    print(("{:15s} : {:g}".format("biased kurt", stats[5])))
+    print(_DESC_FMT.format("size", stats[0]))
+    print(_DESC_FMT.format("min", stats[1][0]))
+    print(_DESC_FMT.format("max", stats[1][1]))
+    print(_DESC_FMT.format("mean", stats[2]))
+    print(_DESC_FMT.format("unbiased var", stats[3]))
+    print(_DESC_FMT.format("biased skew", stats[4]))
+    print(_DESC_FMT.format("biased kurt", stats[5]))
 
     return stats
 
 
-def smooth_grid(grid, side_length, radius, filt="tophat"):
+def smooth_grid(grid, side_length, radius, filt="tophat", dtype=np.float64):
     """Smooth a grid by convolution with a filter.
 
     Parameters
@@ -215,6 +394,10 @@ def smooth_grid(grid, side_length, radius, filt="tophat"):
     filt : string, optional
         The name of the filter.  Currently only "tophat" (real space) is
         implemented.  More filters will be added over time.
+    dtype : dtype, optional
+        The floating point precision the smoothing is done in.  Single
+        precision (np.float32) halves the memory needed for large grids.
+        (default: np.float64)
 
     Returns
     -------
@@ -230,37 +413,110 @@ def smooth_grid(grid, side_length, radius, filt="tophat"):
         raise NotImplementedError("Filter not implemented.")
 
     side_length, radius = float(side_length), float(radius)
+    grid = np.asarray(grid, dtype=dtype)
 
     # Do the forward fft
-    grid = np.fft.rfftn(grid)
-
-    #  # Construct a grid of k*radius values
-    #  k = 2.0 * np.pi * np.fft.fftfreq(grid.shape[0],
-    #                                   1/float(grid.shape[0])) / side_length
-    #  k_r = 2.0 * np.pi * np.fft.rfftfreq(grid.shape[0],
-    #                                      1/float(grid.shape[0])) / side_length
-    #  k = np.meshgrid(k, k, k_r, sparse=True, indexing='ij')
-    #  kR = np.sqrt(k[0]**2 + k[1]**2 + k[2]**2)*radius
+    grid = _rfftn(grid)
 
-    # Evaluate the convolution
+    # Evaluate the convolution.  The filter is evaluated voxel by voxel, in
+    # place, so that no kR grid (or any other full size temporary) is needed.
     if filt == "tophat":
-        tophat_filter(grid, side_length, radius)
-        #  fgrid = grid * 3.0 * (np.sin(kR)/kR**3 - np.cos(kR)/kR**2)
-    #  fgrid[kR == 0] = grid[kR == 0]
+        _tophat_filter(grid, side_length, radius)
 
     # Inverse transform back to real space
-    #  grid = np.fft.irfftn(fgrid).real
-    grid = np.fft.irfftn(grid).real
-
-    # Make sure fgrid is marked available for garbage collection
-    #  del(fgrid)
-    #  del(k)
-    #  del(kR)
+    grid = _irfftn(grid).real
 
     return grid
 
 
-def power_spectrum(grid, side_length, n_bins, dimensional=False):
+class SmoothingKernel:
+    """Repeatedly smooth grids of a fixed shape, reusing the FFT plans.
+
+    When pyFFTW is available the forward and inverse transforms are planned
+    once (with FFTW_MEASURE) on aligned buffers owned by the kernel, so that
+    smoothing many grids or one grid with many radii only pays for the
+    planning once.  Otherwise numpy.fft is used.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the grids to be smoothed
+    side_length : float
+        The side length of the grids (assumes all side lengths are equal)
+    filt : string, optional
+        The name of the filter.  Currently only "tophat" (real space) is
+        implemented.
+    threads : int, optional
+        The number of threads used by FFTW.  (default: all CPUs)
+    dtype : dtype, optional
+        The floating point precision the smoothing is done in.
+        (default: np.float64)
+    """
+
+    IMPLEMENTED_FILTERS = ("tophat",)
+
+    def __init__(self, shape, side_length, filt="tophat", threads=None, dtype=np.float64):
+        if filt not in self.IMPLEMENTED_FILTERS:
+            raise NotImplementedError("Filter not implemented.")
+
+        self.shape = tuple(shape)
+        self.side_length = float(side_length)
+        self.filt = filt
+        self.dtype = np.dtype(dtype)
+
+        if pyfftw is not None:
+            threads = _NTHREADS if threads is None else threads
+            freq_shape = self.shape[:-1] + (self.shape[-1] // 2 + 1,)
+            self._real = pyfftw.empty_aligned(self.shape, self.dtype)
+            self._freq = pyfftw.empty_aligned(freq_shape, np.result_type(self.dtype, np.complex64))
+            self._forward = pyfftw.FFTW(
+                self._real, self._freq, axes=(0, 1, 2), flags=("FFTW_MEASURE",), threads=threads
+            )
+            self._inverse = pyfftw.FFTW(
+                self._freq,
+                self._real,
+                axes=(0, 1, 2),
+                direction="FFTW_BACKWARD",
+                flags=("FFTW_MEASURE",),
+                threads=threads,
+            )
+
+    def smooth(self, grid, radius):
+        """Smooth a grid by convolution with the filter.
+
+        Parameters
+        ----------
+        grid : ndarray
+            The grid to be smoothed.  Must have the shape the kernel was
+            created with.
+        radius : float
+            The radius of the smoothing filter
+
+        Returns
+        -------
+        smoothed_grid : ndarray
+            The smoothed grid.
+        """
+
+        if grid.shape != self.shape:
+            raise ValueError("Grid shape {} does not match kernel shape {}.".format(grid.shape, self.shape))
+
+        radius = float(radius)
+
+        if pyfftw is None:
+            ft_grid = np.fft.rfftn(np.asarray(grid, dtype=self.dtype))
+            _tophat_filter(ft_grid, self.side_length, radius)
+            return np.fft.irfftn(ft_grid, s=self.shape)
+
+        self._real[...] = grid
+        self._forward()
+        _tophat_filter(self._freq, self.side_length, radius)
+        self._inverse()
+
+        return self._real.copy()
+
+
+def power_spectrum(grid, side_length, n_bins, dimensional=False, dtype=np.float64):
 
     r"""Calculate the dimensionless and dimensional power spectra of a grid (G):
 
@@ -285,6 +541,12 @@ def power_spectrum(grid, side_length, n_bins, dimensional=False):
         Switch for calculating dimensional power spectrum
         Default is False
 
+    dtype : dtype (optional)
+        The floating point precision of the transform.  Single precision
+        (np.float32) halves the memory needed for large grids.  The k
+        magnitudes and bin sums are always double precision.
+        Default is np.float64
+
     Returns
     -------
     kmean : ndarray
@@ -306,40 +568,59 @@ def power_spectrum(grid, side_length, n_bins, dimensional=False):
     volume = side_length ** 3
 
     # do the FFT (note the normalising 1.0/N_cells factor)
-    ft_grid = np.fft.rfftn(grid) / float(grid.size)
+    grid = np.asarray(grid, dtype=dtype)
+    ft_grid = _rfftn(grid)
+    ft_grid /= grid.size
 
     # generate a grid of k magnitudes
     k1d = 2.0 * np.pi * np.fft.fftfreq(grid.shape[0], 1 / float(grid.shape[0])) / side_length
     k1d_r = 2.0 * np.pi * np.fft.rfftfreq(grid.shape[0], 1 / float(grid.shape[0])) / side_length
-    k = np.meshgrid(k1d, k1d, k1d_r, sparse=True, indexing="ij")
-    k = np.sqrt(k[0] ** 2 + k[1] ** 2 + k[2] ** 2)
-
-    # bin up the k magnitudes
+    k1d_sq = k1d ** 2
+    k = k1d_sq[:, None, None] + k1d_sq[None, :, None] + (k1d_r ** 2)[None, None, :]
+    np.sqrt(k, out=k)
+
+    # bin up the k magnitudes.  The edges are log spaced, so the bin of each k
+    # can be calculated directly instead of searched for, then nudged by one
+    # where round-off puts k on the wrong side of its edge.  Modes outside
+    # the edges go in the first/last bin.
     k_edges = np.logspace(np.log10(k1d_r[1]), np.log10(k1d_r[-1]), n_bins + 1)
-    k_bin = np.digitize(k.flat, k_edges) - 1
+    log_k_min = np.log(k_edges[0])
+    k_bin = np.log(np.maximum(k.ravel(), k_edges[0]))
+    k_bin -= log_k_min
+    k_bin *= n_bins / (np.log(k_edges[-1]) - log_k_min)
+    k_bin = k_bin.astype(np.intp)
+    np.clip(k_bin, 0, n_bins - 1, k_bin)
+    k_bin -= k.ravel() < k_edges[k_bin]
+    k_bin += k.ravel() >= k_edges[k_bin + 1]
     np.clip(k_bin, 0, n_bins - 1, k_bin)
-    k_bin.shape = k.shape
-
-    # loop through each k magnitude bin and calculate the mean power, k and
-    # uncert
-    kmean = np.zeros(n_bins)
-    power_dim = np.zeros(n_bins)
-    uncert_dim = np.zeros(n_bins)
-    power = np.zeros(n_bins)
-    uncert = np.zeros(n_bins)
-
-    for ii in range(n_bins):
-
-        sel = k_bin == ii
-        val_dim = np.abs(ft_grid[sel]) ** 2 * volume
-        val = k[sel] ** 3 * np.abs(ft_grid[sel]) ** 2 / (2.0 * np.pi ** 2) * volume
-
-        kmean[ii] = k[sel].mean()
-        power_dim[ii] = val_dim.mean()
-        uncert_dim[ii] = power_dim[ii] / np.sqrt(len(k[sel]))
 
-        power[ii] = val.mean()
-        uncert[ii] = power[ii] / np.sqrt(len(k[sel]))
+    # rfftn drops the conjugate (-k) half of the modes, so every mode needs to
+    # count twice, except for those on the kz = 0 and Nyquist planes which
+    # already contain both halves
+    weight = np.full(k1d_r.size, 2.0)
+    weight[0] = 1.0
+    if grid.shape[0] % 2 == 0:
+        weight[-1] = 1.0
+
+    # accumulate the sums needed for the mean power, k and uncert of each k
+    # magnitude bin
+    k = k.ravel()
+    ft_grid = ft_grid.ravel()
+    val_dim = ft_grid.real ** 2
+    val_dim += ft_grid.imag ** 2
+    val_dim *= volume
+
+    counts, k_sum, power_dim_sum, power_sum, n_modes = _power_spectrum_sums(k_bin, k, val_dim, weight, n_bins)
+
+    # empty bins are left as NaN.  The conjugate weights only apply to the
+    # means: the dropped half of the modes are just the complex conjugates of
+    # the stored ones, so the uncertainties use the number of stored modes.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        kmean = k_sum / counts
+        power_dim = power_dim_sum / counts
+        power = power_sum / (2.0 * np.pi ** 2) / counts
+        uncert_dim = power_dim / np.sqrt(n_modes)
+        uncert = power / np.sqrt(n_modes)
 
     if dimensional:
         return kmean, power, uncert, power_dim, uncert_dim
@@ -1,14 +1,18 @@
 import numpy as np
-from scipy import optimize as so
-from scipy.ndimage.filters import gaussian_filter
+from scipy.ndimage import gaussian_filter
 
 
-def _find_confidence_interval(x, pdf, confidence_level):
-    return pdf[pdf > x].sum() - confidence_level
+def _confidence_levels(pdf, confidence_levels):
+    # Return the pdf value above which the pdf sums to each of the requested
+    # confidence levels.  One sort and cumulative sum gives all of them.
+    flat = np.sort(pdf, axis=None)[::-1]
+    cum = np.cumsum(flat)
+    ind = np.minimum(np.searchsorted(cum, confidence_levels), flat.size - 1)
+    return flat[ind]
 
 
 def density_contour(xdata, ydata, bins, ax, label=True, smooth=0.0, clabel_kwargs={}, **contour_kwargs):
-    """ Create a density contour plot.
+    r""" Create a density contour plot.
 
     Code modified from:
     https://gist.github.com/adrn/3993992#file-density_contour-py
@@ -49,7 +53,7 @@ def density_contour(xdata, ydata, bins, ax, label=True, smooth=0.0, clabel_kwarg
         nbins_x = bins[0]
         nbins_y = bins[1]
 
-    H, xedges, yedges = np.histogram2d(xdata, ydata, bins=bins, normed=True)
+    H, xedges, yedges = np.histogram2d(xdata, ydata, bins=bins, density=True)
     x_bin_sizes = (xedges[1:] - xedges[:-1]).reshape((1, nbins_x))
     y_bin_sizes = (yedges[1:] - yedges[:-1]).reshape((nbins_y, 1))
 
@@ -58,10 +62,7 @@ def density_contour(xdata, ydata, bins, ax, label=True, smooth=0.0, clabel_kwarg
     if smooth > 0:
         pdf = gaussian_filter(pdf, smooth)
 
-    one_sigma = so.brentq(_find_confidence_interval, 0.0, 1.0, args=(pdf, 0.39346934))
-    two_sigma = so.brentq(_find_confidence_interval, 0.0, 1.0, args=(pdf, 0.864664717))
-    three_sigma = so.brentq(_find_confidence_interval, 0.0, 1.0, args=(pdf, 0.988891003))
-    levels = [three_sigma, two_sigma, one_sigma]
+    levels = list(_confidence_levels(pdf, [0.988891003, 0.864664717, 0.39346934]))
 
     X, Y = 0.5 * (xedges[1:] + xedges[:-1]), 0.5 * (yedges[1:] + yedges[:-1])
     Z = pdf.T